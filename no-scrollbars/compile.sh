@@ -1,5 +1,5 @@
 #!/usr/bin/env bash
 
-../engine/engine --compile noscrollbars.py > noscrollbars
+../engine/engine --compile noscrollbars.py --bytecode-cache > noscrollbars
 
 chmod +x noscrollbars
@@ -1,33 +1,83 @@
 #!/usr/bin/env python3
 
+import sys
+
 import smartnotes
 
 class RliterateToSmartNotesConverter(object):
 
+    BATCH_SIZE = 1000
+
     def convert(self, rliterate_path, smart_notes_path):
         self.rliterate = smartnotes.read_json_file(rliterate_path, {})
         self.note_db = smartnotes.NoteDb(smart_notes_path)
+        self.pages = {}
+        self.index_pages(self.rliterate["root_page"])
+        self.notes = []
+        self.links = []
+        self.import_start = None
+        self.imported_note_count = 0
+        self.imported_link_count = 0
         self.page_links = set()
         self.page_id_to_note_id = {}
-        self.convert_page(self.rliterate["root_page"])
-        for note_id, page_id in self.page_links:
-            self.note_db.create_link(note_id, self.page_id_to_note_id[page_id])
+        with self.note_db.transaction():
+            self.convert_page(self.rliterate["root_page"])
+            for note_id, page_id in self.page_links:
+                self.create_link(note_id, self.page_id_to_note_id[page_id])
+            self.flush()
+        sys.stderr.write("\n")
+
+    def index_pages(self, page):
+        self.pages[page["id"]] = page
+        for child in page["children"]:
+            self.index_pages(child)
+
+    def create_note(self, **params):
+        note_id = smartnotes.genid()
+        self.notes.append((note_id, params))
+        if len(self.notes) >= self.BATCH_SIZE:
+            self.flush()
+        return note_id
+
+    def create_link(self, from_id, to_id):
+        self.links.append((from_id, to_id))
+        if len(self.links) >= self.BATCH_SIZE:
+            self.flush()
+
+    def flush(self):
+        self.import_start = self.note_db.import_notes(
+            self.notes,
+            self.links,
+            self.import_start
+        )
+        self.imported_note_count += len(self.notes)
+        self.imported_link_count += len(self.links)
+        self.notes = []
+        self.links = []
+        self.report_progress()
+
+    def report_progress(self):
+        sys.stderr.write(
+            f"\rConverted {len(self.page_id_to_note_id)}/{len(self.pages)} pages "
+            f"({self.imported_note_count} notes, {self.imported_link_count} links)"
+        )
 
     def convert_page(self, page, parent_page_note_id=None):
-        page_note_id = self.note_db.create_note(**{
+        page_note_id = self.create_note(**{
             "text": page["title"],
             "tags": ["title"],
         })
         self.page_id_to_note_id[page["id"]] = page_note_id
+        self.report_progress()
         if parent_page_note_id is not None:
-            self.note_db.create_link(parent_page_note_id, page_note_id)
+            self.create_link(parent_page_note_id, page_note_id)
         for paragraph in page["paragraphs"]:
             if paragraph["type"] == "text":
                 self.create_text_fragments_note(page_note_id, paragraph["fragments"])
             elif paragraph["type"] == "code":
-                self.note_db.create_link(
+                self.create_link(
                     page_note_id,
-                    self.note_db.create_note(**{
+                    self.create_note(**{
                         "type": "code",
                         "text": "<code>",
                         "filepath": paragraph["filepath"],
@@ -71,20 +121,20 @@ class RliterateToSmartNotesConverter(object):
     def convert_list(self, list_obj, parent_note_id):
         if list_obj["child_type"] is None and len(list_obj["children"]) == 0:
             return
-        list_note_id = self.note_db.create_note(
+        list_note_id = self.create_note(
             text=f"<{list_obj['child_type']} list>"
         )
-        self.note_db.create_link(parent_note_id, list_note_id)
+        self.create_link(parent_note_id, list_note_id)
         for child in list_obj["children"]:
             self.create_text_fragments_note(list_note_id, child["fragments"])
             self.convert_list(child, list_note_id)
 
     def create_text_fragments_note(self, parent_note_id, fragments):
         self.text_fragments_page_links = set()
-        child_note_id = self.note_db.create_note(
+        child_note_id = self.create_note(
             text=self.convert_text_fragments(fragments)
         )
-        self.note_db.create_link(parent_note_id, child_note_id)
+        self.create_link(parent_note_id, child_note_id)
         for page_id in self.text_fragments_page_links:
             self.page_links.add((child_note_id, page_id))
 
@@ -110,17 +160,7 @@ class RliterateToSmartNotesConverter(object):
         if default:
             return default
         else:
-            return self.find_page(page_id)["title"]
-
-    def find_page(self, page_id, page=None):
-        if page is None:
-            page = self.rliterate["root_page"]
-        if page["id"] == page_id:
-            return page
-        for child in page["children"]:
-            page = self.find_page(page_id, child)
-            if page is not None:
-                return page
+            return self.pages[page_id]["title"]
 
 if __name__ == "__main__":
     RliterateToSmartNotesConverter().convert("smartnotes.rliterate", "smartnotes.notes")
@@ -1904,6 +1904,26 @@ class NoteDb(Immutable):
         new_links.pop(link_id)
         self._replace(links=new_links)
 
+    def import_notes(self, notes, links, start=None):
+        if start is None:
+            start = datetime.datetime.utcnow()
+        def timestamp(index):
+            return (start + datetime.timedelta(microseconds=index)).isoformat(
+                timespec="microseconds"
+            )
+        new_notes = dict(self._get("notes"))
+        for index, (note_id, params) in enumerate(notes):
+            new_notes[note_id] = dict(params, timestamp_created=timestamp(index))
+        new_links = dict(self._get("links"))
+        for index, (from_id, to_id) in enumerate(links):
+            new_links[genid()] = {
+                "from": from_id,
+                "to": to_id,
+                "timestamp_created": timestamp(index),
+            }
+        self._replace(notes=new_notes, links=new_links)
+        return start + datetime.timedelta(microseconds=max(len(notes), len(links)))
+
     def _ensure_note_id(self, note_id):
         if note_id not in self._get("notes"):
             raise NoteNotFound(str(note_id))
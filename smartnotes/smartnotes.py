@@ -1,19 +1,28 @@
 #!/usr/bin/env python3
 
 from collections import defaultdict
+import bisect
 import contextlib
+import ctypes
+import ctypes.util
 import datetime
-import difflib
 import doctest
 import json
 import math
 import os
+import random
 import re
+import select
+import sqlite3
+import struct
 import subprocess
 import sys
 import tempfile
+import threading
+import time
 import uuid
 import webbrowser
+import zlib
 
 ###############################################################################
 # App Engine
@@ -27,32 +36,39 @@ import pygame
 class PygameCairoEngine:
 
     def run(self, app):
-        pygame.init()
-        pygame.key.set_repeat(500, 30)
-        root_widget = app(PygameWindow())
+        with STARTUP_PROFILER.phase("pygame init"):
+            pygame.init()
+            pygame.key.set_repeat(500, 30)
+        window = PygameWindow()
+        with STARTUP_PROFILER.phase("create widgets"):
+            root_widget = app(window)
         screen = pygame.display.set_mode((1280, 720), pygame.RESIZABLE)
         clock = pygame.time.Clock()
         external_text_entries = ExternalTextEntries()
-        pygame.time.set_timer(USER_EVENT_CHECK_EXTERNAL, 1000)
         pygame_cairo_surface = self.create_pygame_cairo_surface(screen)
         while True:
-            for event in pygame.event.get():
+            events, dropped = coalesce_mouse_motion(pygame.event.get())
+            window.coalesced_event_count += dropped
+            for event in events:
                 if event.type == pygame.QUIT:
                     return
                 elif event.type == pygame.VIDEORESIZE:
                     pygame_cairo_surface = self.create_pygame_cairo_surface(screen)
                 elif event.type == USER_EVENT_CHECK_EXTERNAL:
-                    external_text_entries.check()
+                    external_text_entries.check(event.entry)
                 elif event.type == USER_EVENT_EXTERNAL_TEXT_ENTRY:
                     external_text_entries.add(event.entry)
                 else:
                     root_widget.process_event(PygameEvent(event))
-            root_widget.update(screen.get_rect(), clock.get_time())
+            with STARTUP_PROFILER.phase("first update"):
+                root_widget.update(screen.get_rect(), clock.get_time())
             pygame_cairo_surface.lock()
-            root_widget.draw(CairoCanvas(self.create_cairo_image(pygame_cairo_surface)))
+            with STARTUP_PROFILER.phase("first draw"):
+                root_widget.draw(CairoCanvas(self.create_cairo_image(pygame_cairo_surface)))
             pygame_cairo_surface.unlock()
             screen.blit(pygame_cairo_surface, (0, 0))
             pygame.display.flip()
+            STARTUP_PROFILER.report()
             clock.tick(60)
 
     def create_pygame_cairo_surface(self, screen):
@@ -76,6 +92,10 @@ class PygameCairoEngine:
 
 class CairoCanvas(object):
 
+    MAX_TEXT_LAYOUTS = 1000
+
+    text_layouts = {}
+
     def __init__(self, surface):
         self.surface = surface
         self.ctx = cairo.Context(self.surface)
@@ -125,7 +145,8 @@ class CairoCanvas(object):
         textalign="left",
         italic=False,
         split=True,
-        color=(0, 0, 0)
+        color=(0, 0, 0),
+        cache_layout=False
     ):
         if box.height <= 0:
             return
@@ -144,7 +165,12 @@ class CairoCanvas(object):
                 cairo_slant
             )
         self._set_color(color)
-        metrics, scale_factor = self._find_best_fit(text, box, split, size)
+        if cache_layout:
+            metrics, scale_factor = self._find_cached_fit(
+                (text, box.width, box.height, split, size, face, italic)
+            )
+        else:
+            metrics, scale_factor = self._find_best_fit(text, box, split, size)
         self.ctx.save()
         xoffset = 0
         yoffset = 0
@@ -168,6 +194,26 @@ class CairoCanvas(object):
             self.ctx.stroke()
         self.ctx.restore()
 
+    def _find_cached_fit(self, key):
+        if key not in self.text_layouts:
+            if len(self.text_layouts) >= self.MAX_TEXT_LAYOUTS:
+                self.text_layouts.clear()
+            text, width, height, split, size, face, italic = key
+            metrics, scale_factor = self._find_best_fit(
+                text,
+                pygame.Rect(0, 0, width, height),
+                split,
+                size
+            )
+            self.text_layouts[key] = (
+                metrics,
+                scale_factor,
+                self.ctx.get_font_matrix().xx
+            )
+        metrics, scale_factor, font_size = self.text_layouts[key]
+        self.ctx.set_font_size(font_size)
+        return metrics, scale_factor
+
     def _find_best_fit(self, text, box, split, size):
         self.ctx.set_font_size(size)
         if split:
@@ -276,6 +322,63 @@ class CairoCanvas(object):
             self.surface.get_height()
         )
 
+class StartupProfiler(object):
+
+    """
+    Collects timings of named phases until the first frame is shown.
+    Phases can nest. Each phase records its total time and its own time,
+    which excludes nested phases, so own times never count twice.
+
+    >>> profiler = StartupProfiler()
+    >>> profiler.enabled = True
+    >>> with profiler.phase("load"):
+    ...     with profiler.phase("parse"):
+    ...         pass
+    >>> [(depth, name) for depth, name, duration, own in profiler.timings]
+    [(0, 'load'), (1, 'parse')]
+    >>> load, parse = profiler.timings
+    >>> abs(load[3] - (load[2] - parse[2])) < 1e-9
+    True
+    """
+
+    def __init__(self):
+        self.enabled = False
+        self.start = time.perf_counter()
+        self.timings = []
+        self.nested_durations = []
+        self.reported = False
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        if not self.enabled or self.reported:
+            yield
+            return
+        timing = [len(self.nested_durations), name, 0, 0]
+        self.timings.append(timing)
+        self.nested_durations.append(0)
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            duration = time.perf_counter() - start
+            timing[2] = duration
+            timing[3] = duration - self.nested_durations.pop()
+            if self.nested_durations:
+                self.nested_durations[-1] += duration
+
+    def report(self):
+        if self.enabled and not self.reported:
+            self.reported = True
+            total = time.perf_counter() - self.start
+            sys.stderr.write(f"{'phase':<24} {'total':>10} {'own':>10}\n")
+            for depth, name, duration, own in self.timings:
+                sys.stderr.write(f"{'  '*depth+name:<24} {duration*1000:8.1f}ms {own*1000:8.1f}ms\n")
+            other = total - sum(own for depth, name, duration, own in self.timings)
+            sys.stderr.write(f"{'other':<24} {'':>10} {other*1000:8.1f}ms\n")
+            sys.stderr.write(f"{'time to first frame':<24} {total*1000:8.1f}ms\n")
+
+STARTUP_PROFILER = StartupProfiler()
+
 ###############################################################################
 # App
 ###############################################################################
@@ -303,6 +406,7 @@ FONT_MONOSPACE           = "Monospace"
 FONT_TEXT                = "San-Serif"
 EDITOR_COMMAND           = ["gvim", "--nofork", None]
 NUM_SEARCH_RESULTS       = 8
+TABLE_PAGE_SIZE          = 48
 NEW_NOTE_TEXT            = "Enter note text...\n"
 KEY_QUIT                 = "ctrl+q"
 KEY_UNDO                 = "ctrl+z"
@@ -321,6 +425,8 @@ KEY_OPEN_LINKS           = "g"
 KEY_TOGGLE_TABLE_NETWORK = "t"
 KEY_MOVE_UP              = "1"
 KEY_MOVE_DOWN            = "2"
+KEY_NEXT_PAGE            = "page down"
+KEY_PREVIOUS_PAGE        = "page up"
 BIB_COLOR                = (250, 150, 150)
 TAG_ATTRIBUTES           = [
     {"name": "title",     "textalign": "center"},
@@ -365,6 +471,9 @@ class Widget(object):
     def clear_quick_focus(self):
         return self._window.clear_quick_focus()
 
+    def drop_focus(self):
+        self._window.drop_focus(self)
+
     def has_focus(self):
         return self._window.is_focused(self)
 
@@ -395,6 +504,9 @@ class Widget(object):
     def quit(self):
         self._window.close()
 
+    def get_coalesced_event_count(self):
+        return self._window.coalesced_event_count
+
     def post_event(self, event_type, **kwargs):
         pygame.event.post(pygame.event.Event(event_type, **kwargs))
 
@@ -462,11 +574,7 @@ class NoteBaseWidget(Widget):
         self.settings = settings
 
     def is_deleted(self):
-        try:
-            self.db.get_note_data(self.note_id)
-            return False
-        except NoteNotFound:
-            return True
+        return not self.db.has_note(self.note_id)
 
     def bubble_event(self, event):
         if event.key_down(KEY_EDIT_NOTE):
@@ -722,6 +830,17 @@ class WindowFocusMixin(object):
         else:
             return False
 
+    def drop_focus(self, widget):
+        if self.focused_widget is widget:
+            self.focused_widget = None
+        if self.quick_focused_widget is widget:
+            self.quick_focused_widget = None
+        if self.saved_focus is not None:
+            self.saved_focus = tuple(
+                None if x is widget else x
+                for x in self.saved_focus
+            )
+
     def is_focused(self, widget):
         if self.quick_focused_widget is None:
             return widget is self.focused_widget
@@ -911,6 +1030,13 @@ class Immutable(object):
 
 class ExternalTextEntry(object):
 
+    IN_CLOSE_WRITE = 0x00000008
+    IN_MOVED_TO = 0x00000080
+
+    WATCH_INTERVAL_SECONDS = 0.1
+
+    DEBOUNCE_SECONDS = 0.2
+
     def __init__(self, text, editor_command):
         self.text = text
         self.f = tempfile.NamedTemporaryFile(suffix="-smartnotes-external-")
@@ -922,6 +1048,123 @@ class ExternalTextEntry(object):
             in editor_command
         ])
 
+    def start_watching(self):
+        threading.Thread(target=self._watch, daemon=True).start()
+
+    def _watch(self):
+        fd = self._inotify_watch()
+        if fd is None:
+            self._poll()
+        else:
+            try:
+                self._read_inotify_events(fd)
+            finally:
+                os.close(fd)
+
+    def _inotify_watch(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+            fd = libc.inotify_init()
+        except (OSError, AttributeError):
+            return None
+        if fd < 0:
+            return None
+        # Watch the directory since editors often save by renaming a new
+        # file over the old one.
+        if libc.inotify_add_watch(
+            fd,
+            os.fsencode(os.path.dirname(self.f.name)),
+            self.IN_CLOSE_WRITE|self.IN_MOVED_TO
+        ) < 0:
+            os.close(fd)
+            return None
+        return fd
+
+    def _read_inotify_events(self, fd):
+        name = os.fsencode(os.path.basename(self.f.name))
+        exited_r, exited_w = os.pipe()
+        threading.Thread(
+            target=self._close_when_exited,
+            args=(exited_w,),
+            daemon=True
+        ).start()
+        changed_at = None
+        try:
+            while True:
+                if changed_at is None:
+                    timeout = None
+                else:
+                    timeout = max(
+                        0,
+                        changed_at + self.DEBOUNCE_SECONDS - time.monotonic()
+                    )
+                readable, _, _ = select.select([fd, exited_r], [], [], timeout)
+                if exited_r in readable:
+                    self._post_check()
+                    return
+                if fd in readable and name in self._read_inotify_names(fd):
+                    changed_at = time.monotonic()
+                if (
+                    changed_at is not None and
+                    time.monotonic() - changed_at >= self.DEBOUNCE_SECONDS
+                ):
+                    changed_at = None
+                    self._post_check()
+        finally:
+            os.close(exited_r)
+
+    def _read_inotify_names(self, fd):
+        data = os.read(fd, 4096)
+        names = []
+        offset = 0
+        while offset < len(data):
+            wd, mask, cookie, length = struct.unpack_from("iIII", data, offset)
+            offset += struct.calcsize("iIII")
+            names.append(data[offset:offset+length].rstrip(b"\0"))
+            offset += length
+        return names
+
+    def _close_when_exited(self, exited_w):
+        self.p.wait()
+        os.close(exited_w)
+
+    def _poll(self):
+        last_stat = self._stat()
+        changed_at = None
+        while last_stat is not None:
+            try:
+                self.p.wait(timeout=self.WATCH_INTERVAL_SECONDS)
+                exited = True
+            except subprocess.TimeoutExpired:
+                exited = False
+            stat = self._stat()
+            if stat is None:
+                return
+            if stat != last_stat:
+                last_stat = stat
+                changed_at = time.monotonic()
+            if exited or (
+                changed_at is not None and
+                time.monotonic() - changed_at >= self.DEBOUNCE_SECONDS
+            ):
+                changed_at = None
+                self._post_check()
+            if exited:
+                return
+
+    def _post_check(self):
+        pygame.event.post(pygame.event.Event(
+            USER_EVENT_CHECK_EXTERNAL,
+            entry=self
+        ))
+
+    def _stat(self):
+        try:
+            stat = os.fstat(self.f.fileno())
+        except (ValueError, OSError):
+            return None
+        return (stat.st_mtime_ns, stat.st_size)
+
     def check(self):
         self.f.seek(0)
         text = self.f.read().decode("utf-8")
@@ -938,6 +1181,8 @@ class ExternalTextEntry(object):
 
 class SmartNotesWidget(VBox):
 
+    FILE_CHECK_INTERVAL_MS = 500
+
     def __init__(self, window):
         VBox.__init__(self, window, None)
         if len(sys.argv) < 2:
@@ -948,6 +1193,7 @@ class SmartNotesWidget(VBox):
         self.set_title(format_title("Smart Notes", path))
         self.toggle_table_network_after_event_processing = False
         self.db = NoteDb(path)
+        self.file_check_elapsed = 0
         self.overlay = self.instantiate(OverlayWidget, self.db)
         self.note_browser = self.instantiate(NoteBrowserWidget,
             self.db,
@@ -963,6 +1209,12 @@ class SmartNotesWidget(VBox):
         ))
         self.add(self.note_browser)
         self.debug_bar = self.add(self.instantiate(DebugBar))
+        self.global_key_handlers = PygameEvent.compile_key_handlers({
+            KEY_QUIT: self.quit,
+            KEY_UNDO: self.db.undo,
+            KEY_REDO: self.db.redo,
+            KEY_TOGGLE_DEBUG_BAR: self.debug_bar.toggle,
+        })
         self.note_browser.focus()
 
     def bubble_event(self, event):
@@ -986,14 +1238,9 @@ class SmartNotesWidget(VBox):
             if event.mouse_motion():
                 self.overlay.set_link_target(None)
                 self.clear_quick_focus()
-            if event.key_down(KEY_QUIT):
-                self.quit()
-            elif event.key_down(KEY_UNDO):
-                self.db.undo()
-            elif event.key_down(KEY_REDO):
-                self.db.redo()
-            elif event.key_down(KEY_TOGGLE_DEBUG_BAR):
-                self.debug_bar.toggle()
+            key_handler = event.key_down_handler(self.global_key_handlers)
+            if key_handler is not None:
+                key_handler()
             elif event.key_down(KEY_CLEAR_FOCUS) and self.clear_quick_focus():
                 pass
             elif event.window_gained_focus():
@@ -1012,6 +1259,10 @@ class SmartNotesWidget(VBox):
         self.note_browser.focus()
 
     def update(self, rect, elapsed_ms):
+        self.file_check_elapsed += elapsed_ms
+        if self.file_check_elapsed >= self.FILE_CHECK_INTERVAL_MS:
+            self.file_check_elapsed = 0
+            self.db.consolidate_changed_files()
         self.overlay.update(rect, elapsed_ms)
         VBox.update(self, rect, elapsed_ms)
         self.rect = rect
@@ -1273,6 +1524,9 @@ class NetworkWidget(Widget):
         self.pos = (-1, -1)
         self.notes = []
         self.links = []
+        self.previous_links = {}
+        self.claimed_notes = set()
+        self.hit_index = None
         self.open_last_note()
 
     def open_last_note(self):
@@ -1295,13 +1549,28 @@ class NetworkWidget(Widget):
             )
         else:
             Widget.process_event(self, event)
+            for widget in self._event_targets(event):
+                widget.process_event(event)
+
+    def _event_targets(self, event):
+        pos = mouse_event_pos(event)
+        if pos is None:
+            return self.notes + self.links
+        if self.hit_index is None:
+            self.hit_index = SpatialIndex()
             for note in self.notes:
-                note.process_event(event)
+                self.hit_index.add(note.rect, note)
             for link in self.links:
-                link.process_event(event)
+                if link.allotted_rect is not None:
+                    self.hit_index.add(link.allotted_rect, link)
+        return self.hit_index.query(pos)
 
     def open_note(self, note_id):
         if self.root_note is None or self.root_note.note_id != note_id:
+            for note in self.notes:
+                if note.note_id == note_id:
+                    self.make_root(note)
+                    return
             self.make_root(self.instantiate(
                 NetworkNote,
                 self,
@@ -1311,6 +1580,26 @@ class NetworkWidget(Widget):
                 self.note_settings
             ))
 
+    def reuse_link(self, link_id, note, side):
+        candidates = []
+        for link in self.previous_links.get(link_id, []):
+            if side == "left":
+                near, linked = link.end, link.start
+            else:
+                near, linked = link.start, link.end
+            if linked is not note and linked not in self.claimed_notes:
+                candidates.append((near is not note, link, linked))
+        if not candidates:
+            return None
+        _, link, linked = min(candidates, key=lambda candidate: candidate[0])
+        self.previous_links[link_id].remove(link)
+        self.claimed_notes.add(linked)
+        if side == "left":
+            link.attach(linked, note)
+        else:
+            link.attach(note, linked)
+        return link.with_side(side)
+
     def make_root(self, note):
         if note is not self.root_note:
             self.root_note = note
@@ -1320,9 +1609,13 @@ class NetworkWidget(Widget):
     def update(self, rect, elapsed_ms):
         Widget.update(self, rect, elapsed_ms)
         self.rect = rect
+        self.hit_index = None
         self.stripe_rects = []
         padding = 8
         self.old_notes = self.notes
+        self.previous_links = defaultdict(list)
+        for link in self.links:
+            self.previous_links[link.link_id].append(link)
         self.notes = []
         self.links = []
         middle_stripe = self._stripe(rect, 0.3)
@@ -1330,6 +1623,7 @@ class NetworkWidget(Widget):
             self.open_last_note()
         if self.root_note is None:
             return
+        self.claimed_notes = {self.root_note}
         self.root_note.update(
             middle_stripe,
             elapsed_ms,
@@ -1439,8 +1733,16 @@ class NetworkWidget(Widget):
         if DEBUG_NOTE_BORDER:
             for rect in self.stripe_rects:
                 canvas.draw_rect(rect, (255, 255, 0), 2)
+        for color, virtual in [(COLOR_LINE, False), (COLOR_VIRTUAL_LINE, True)]:
+            for link in self.links:
+                if link.is_virtual() == virtual:
+                    link.add_line_path(canvas)
+            canvas._set_color(color)
+            canvas.set_line_width(1.5)
+            canvas.stroke()
         for link in self.links:
             link.draw(canvas)
+        self.hit_index = None
         for note in self.notes:
             note.draw(canvas)
         Widget.draw(self, canvas)
@@ -1459,8 +1761,14 @@ class NetworkNote(NoteBaseWidget):
         self.previous = None
 
     def clear_hidden_links(self, visible_links):
-        self.incoming = [x for x in self.incoming if x in visible_links]
-        self.outgoing = [x for x in self.outgoing if x in visible_links]
+        self.incoming = [
+            x for x in self.incoming
+            if x in visible_links and x.end is self
+        ]
+        self.outgoing = [
+            x for x in self.outgoing
+            if x in visible_links and x.start is self
+        ]
 
     def open_me(self):
         self.network.make_root(self)
@@ -1487,15 +1795,9 @@ class NetworkNote(NoteBaseWidget):
             NoteBaseWidget.process_event(self, event)
 
     def update_incoming(self):
-        by_id = {
-            link.link_id: link
-            for link in self.incoming
-        }
         self.incoming = []
         for link_id, link_data in self.db.get_incoming_links(self.note_id):
-            if link_id in by_id:
-                self.incoming.append(by_id.pop(link_id).with_side("left"))
-            else:
+            if self.network.reuse_link(link_id, self, "left") is None:
                 self.instantiate(LinkWidget,
                     self.db,
                     link_id,
@@ -1514,15 +1816,9 @@ class NetworkNote(NoteBaseWidget):
         return self.incoming
 
     def update_outgoing(self):
-        by_id = {
-            link.link_id: link
-            for link in self.outgoing
-        }
         self.outgoing = []
         for link_id, link_data in self.db.get_outgoing_links(self.note_id):
-            if link_id in by_id:
-                self.outgoing.append(by_id.pop(link_id).with_side("right"))
-            else:
+            if self.network.reuse_link(link_id, self, "right") is None:
                 self.instantiate(LinkWidget,
                     self.db,
                     link_id,
@@ -1595,14 +1891,20 @@ class LinkWidget(Widget):
         self.db = db
         self.link_id = link_id
         self.link_data = link_data
-        self.start = start
-        self.end = end
-        self.start.outgoing.append(self)
-        self.end.incoming.append(self)
         self.start_pos = None
         self.end_pos = None
+        self.attach(start, end)
         self.with_side(side)
 
+    def attach(self, start, end):
+        self.start = start
+        self.end = end
+        if self not in self.start.outgoing:
+            self.start.outgoing.append(self)
+        if self not in self.end.incoming:
+            self.end.incoming.append(self)
+        return self
+
     def with_side(self, side):
         self.side = side
         return self
@@ -1624,31 +1926,27 @@ class LinkWidget(Widget):
     def update(self, rect, elapsed_ms):
         Widget.update(self, rect, elapsed_ms)
         self.link_data = self.db.get_link_data(self.link_id)
-        start = pygame.math.Vector2(self.start.get_link_out_point())
-        end = pygame.math.Vector2(self.end.get_link_in_point())
-        if start != self.start_pos or end != self.end_pos:
-            self.start_pos = start
-            self.end_pos = end
-            self.padding = 3
-            self.need_redraw = True
-        else:
-            self.need_redraw = False
+        self.start_pos = pygame.math.Vector2(self.start.get_link_out_point())
+        self.end_pos = pygame.math.Vector2(self.end.get_link_in_point())
+
+    def add_line_path(self, canvas):
+        if self.start_pos.x > self.end_pos.x:
+            return
+        startx, starty = self.start_pos
+        endx, endy = self.end_pos
+        width = endx - startx
+        canvas.move_to(startx, starty)
+        canvas.line_to(startx+0.02*width, starty)
+        canvas.curve_to(
+            startx+0.6*width, starty,
+            startx+0.4*width, endy,
+            endx-0.02*width, endy
+        )
+        canvas.line_to(endx, endy)
 
     def draw(self, canvas):
         if self.start_pos.x > self.end_pos.x:
             return
-        if self.need_redraw:
-            self.width = max(1, int(abs(self.start_pos.x-self.end_pos.x)))
-            self.height = max(1, int(abs(self.start_pos.y-self.end_pos.y)))+2*self.padding
-            self.image = canvas.create_image(
-                (self.width, self.height),
-                self._draw_line
-            )
-            self.pos = (
-                min(self.start_pos.x, self.end_pos.x),
-                min(self.start_pos.y, self.end_pos.y)-self.padding,
-            )
-        canvas.blit(self.image, self.pos)
         link_text = self.link_data.get("text", "")
         draw_label = False
         if self.side == "left":
@@ -1685,41 +1983,15 @@ class LinkWidget(Widget):
                 textalign=self.side,
                 face=FONT_MONOSPACE,
                 italic=True,
-                size=20
+                size=20,
+                cache_layout=True
             )
         Widget.draw(self, canvas)
 
-    def _draw_line(self, canvas):
-        if self.start_pos.x < self.end_pos.x:
-            startx = 0
-            endx = self.width
-            c1x = 0.6*self.width
-            c2x = 0.4*self.width
-        else:
-            startx = self.width
-            endx = 0
-            c1x = 0.4*self.width
-            c2x = 0.6*self.width
-        if self.start_pos.y < self.end_pos.y:
-            starty = self.padding
-            endy = self.height-self.padding
-            c1y = 0.0*(self.height-self.padding)+self.padding
-            c2y = 1.0*(self.height-self.padding)+self.padding
-        else:
-            starty = self.height-self.padding
-            endy = self.padding
-            c1y = 1.0*(self.height-self.padding)+self.padding
-            c2y = 0.0*(self.height-self.padding)+self.padding
-        canvas.move_to(startx, starty)
-        canvas.line_to(startx+0.02*(endx-startx), starty)
-        canvas.curve_to(c1x, c1y, c2x, c2y, endx-0.02*(endx-startx), endy)
-        canvas.line_to(endx, endy)
-        canvas._set_color(COLOR_VIRTUAL_LINE if self.is_virtual() else COLOR_LINE)
-        canvas.set_line_width(1.5)
-        canvas.stroke()
-
 class TableWidget(Widget):
 
+    PAGE_INDICATOR_HEIGHT = 30
+
     def __init__(self, window, parent, db, overlay, note_settings):
         Widget.__init__(self, window, parent)
         self.db = db
@@ -1727,90 +1999,135 @@ class TableWidget(Widget):
         self.note_settings = note_settings
         self.notes = []
         self.by_id = {}
+        self.note_pool = []
+        self.page = 0
+        self.page_count = 1
+        self.layout_key = None
+        self.hit_index = None
 
     def process_event(self, event):
-        for note in self.notes:
+        for note in self._event_targets(event):
             note.process_event(event)
         Widget.process_event(self, event)
 
+    def _event_targets(self, event):
+        pos = mouse_event_pos(event)
+        if pos is None:
+            return list(self.notes)
+        if self.hit_index is None:
+            self.hit_index = SpatialIndex()
+            for note in self.notes:
+                self.hit_index.add(note.rect, note)
+        return self.hit_index.query(pos)
+
+    def bubble_event(self, event):
+        if event.key_down(KEY_NEXT_PAGE):
+            self.clear_quick_focus()
+            self.page = min(self.page+1, self.page_count-1)
+        elif event.key_down(KEY_PREVIOUS_PAGE):
+            self.clear_quick_focus()
+            self.page = max(self.page-1, 0)
+        else:
+            Widget.bubble_event(self, event)
+
     def open_note(self, note_id):
         self.note_id = note_id
+        self.page = 0
+        self.clear_quick_focus()
 
     def update(self, rect, elapsed_ms):
+        self.hit_index = None
         self._update_notes_list()
-        self._layout(rect, elapsed_ms)
+        if self.page_count > 1:
+            self.page_rect = rect.copy()
+            self.page_rect.height = self.PAGE_INDICATOR_HEIGHT
+            self.page_rect.bottom = rect.bottom
+            self._layout(rect.inflate(0, -self.PAGE_INDICATOR_HEIGHT*2), elapsed_ms)
+        else:
+            self._layout(rect, elapsed_ms)
         Widget.update(self, rect, elapsed_ms)
 
     def draw(self, canvas):
         for note in self.notes:
             note.draw(canvas)
+        if self.page_count > 1:
+            canvas.render_text(
+                f"{self.page+1}/{self.page_count}",
+                self.page_rect,
+                size=15,
+                face=FONT_MONOSPACE,
+                split=False,
+                color=COLOR_NOTE_TEXT
+            )
         Widget.draw(self, canvas)
 
     def _update_notes_list(self):
-        by_id = {}
+        child_ids = list(self.db.get_children(self.note_id))
+        self.page_count = max(1, math.ceil(len(child_ids) / TABLE_PAGE_SIZE))
+        self.page = min(self.page, self.page_count-1)
+        start = self.page * TABLE_PAGE_SIZE
+        visible_ids = child_ids[start:start+TABLE_PAGE_SIZE]
+        old_by_id = self.by_id
+        kept_notes = [old_by_id.pop(note_id, None) for note_id in visible_ids]
+        for note in old_by_id.values():
+            note.drop_focus()
+        self.note_pool.extend(old_by_id.values())
+        self.by_id = {}
         self.notes.clear()
-        for note_id in self.db.get_children(self.note_id):
-            if note_id in self.by_id:
-                note = self.by_id[note_id]
-            else:
-                note = self.instantiate(
-                    TableNote,
-                    self.db,
-                    self.overlay,
-                    self.note_settings,
-                    note_id,
-                    self.open_note
-                )
+        for note_id, note in zip(visible_ids, kept_notes):
+            if note is None:
+                if self.note_pool:
+                    note = self.note_pool.pop(-1).recycle(note_id)
+                else:
+                    note = self.instantiate(
+                        TableNote,
+                        self.db,
+                        self.overlay,
+                        self.note_settings,
+                        note_id,
+                        self.open_note
+                    )
             self.notes.append(note)
-            by_id[note_id] = note
-        self.by_id = by_id
+            self.by_id[note_id] = note
 
     def _layout(self, rect, elapsed_ms):
         if not self.notes:
             return
-        rows = 1
-        ratio = None
-        fit_box = None
-        notes_per_row = None
-        while True:
-            new_notes_per_row = math.ceil(len(self.notes) / rows)
-            ideal_box = pygame.Rect(
-                0,
-                0,
-                self.note_settings.get_full_width() * new_notes_per_row,
-                self.note_settings.get_full_width() * self.note_settings.get_height_width_ratio() * rows
-            )
-            new_fit_box = ideal_box.fit(rect)
-            new_ratio = new_fit_box.width / ideal_box.width
-            if new_ratio > 1:
-                new_fit_box = ideal_box
-                new_ratio = 1
-            new_fit_box.center = rect.center
-            if ratio is None or new_ratio > ratio:
-                ratio = new_ratio
-                fit_box = new_fit_box
-                notes_per_row = new_notes_per_row
-                rows += 1
-            else:
-                break
-        w = self.note_settings.get_full_width() * ratio
-        h = self.note_settings.get_full_width() * self.note_settings.get_height_width_ratio() * ratio
-        row = 0
-        col = 0
-        for note in self.notes:
-            if col == notes_per_row:
-                col = 0
-                row += 1
-            note.update(
-                pygame.Rect(
-                    fit_box.x+w*col,
-                    fit_box.y+h*row,
-                    w,
-                    h
-                ),
-                elapsed_ms
+        layout_key = (
+            len(self.notes),
+            tuple(rect),
+            self.note_settings.get_full_width(),
+            self.note_settings.get_height_width_ratio(),
+        )
+        if layout_key != self.layout_key:
+            self.layout_key = layout_key
+            self.cell_rects = self._grid_cell_rects(rect)
+        for note, cell_rect in zip(self.notes, self.cell_rects):
+            note.update(cell_rect, elapsed_ms)
+
+    def _grid_cell_rects(self, rect):
+        full_width = self.note_settings.get_full_width()
+        full_height = full_width * self.note_settings.get_height_width_ratio()
+        notes_per_row, rows, ratio = best_grid(
+            len(self.notes),
+            rect.width,
+            rect.height,
+            full_width,
+            full_height
+        )
+        w = full_width * ratio
+        h = full_height * ratio
+        x = rect.centerx - w*notes_per_row/2
+        y = rect.centery - h*rows/2
+        return [
+            pygame.Rect(
+                x+w*(index % notes_per_row),
+                y+h*(index // notes_per_row),
+                w,
+                h
             )
-            col += 1
+            for index in range(len(self.notes))
+        ]
 
 class TableNote(NoteBaseWidget):
 
@@ -1822,6 +2139,10 @@ class TableNote(NoteBaseWidget):
     def open_me(self):
         self.open_callback(self.note_id)
 
+    def recycle(self, note_id):
+        self.note_id = note_id
+        return self
+
     def update(self, rect, elapsed_ms):
         NoteBaseWidget.update(self, rect, elapsed_ms)
         self.rect = self._get_target(rect, align="center")
@@ -1837,6 +2158,8 @@ class DebugBar(Widget):
         self.tot_elapsed_time = 0
         self.frame_count = 0
         self.fps = 0
+        self.coalesced_at_last_second = 0
+        self.coalesced_per_second = 0
 
     def is_visible(self):
         return Widget.is_visible(self) or self.animation.active()
@@ -1853,6 +2176,9 @@ class DebugBar(Widget):
             self.average_elapsed = int(round(self.tot_elapsed_time / self.frame_count))
             self.fps = self.frame_count
             self.frame_count = 0
+            coalesced = self.get_coalesced_event_count()
+            self.coalesced_per_second = coalesced - self.coalesced_at_last_second
+            self.coalesced_at_last_second = coalesced
             self.tot_elapsed_time -= 1000
         percent = self.animation.advance(elapsed_ms)
         if Widget.is_visible(self):
@@ -1875,7 +2201,7 @@ class DebugBar(Widget):
         rect = pygame.Rect((0, 0), (self.rect.width, self.IDEAL_HEIGHT))
         canvas.fill_rect(rect, color=(84, 106, 134))
         canvas.render_text(
-            f"elapsed_ms = {self.average_elapsed} | fps = {self.fps}",
+            f"elapsed_ms = {self.average_elapsed} | fps = {self.fps} | coalesced/s = {self.coalesced_per_second}",
             rect.inflate(-20, -20),
             boxalign="midleft",
             size=15,
@@ -1951,49 +2277,133 @@ class NoteSettings:
 
 class NoteDb(Immutable):
 
+    SORT_INDEX_GAP = 1024
+
+    MAX_EXPANDED_CHUNKS = 10000
+
     def __init__(self, path):
-        Immutable.__init__(self, read_json_file(path, {
-            "version": 1,
-            "notes": {},
-            "links": {},
-        }))
+        self.notes_file = open_notes_file(path)
+        with STARTUP_PROFILER.phase("read notes"):
+            Immutable.__init__(self, self.notes_file.read({
+                "version": 1,
+                "notes": {},
+                "links": {},
+            }))
         self.path = path
-        self.virtual_links = {}
-        self.consolidate_files()
-        self._create_virtual_links()
+        self.virtual_links = None
+        self.adjacency = None
+        self.expanded_chunks = {}
+        self.written_files = {}
+        self.file_stats = {}
+        self.externally_edited_paths = set()
+        self.back_up_external_edits = False
+        with STARTUP_PROFILER.phase("consolidate files"):
+            self.consolidate_files()
 
     def write_files(self):
         parts = self.collect_parts()
         for (file, chunk) in parts.keys():
             if file != tuple() and chunk == tuple():
-                with open(os.path.join(*file), "w") as f:
-                    f.write(self.collect(file, chunk, parts))
+                path = os.path.join(*file)
+                content = self.collect(file, chunk, parts)
+                if self.written_files.get(path) != content or not os.path.exists(path):
+                    if self._changed_on_disk(path) or (
+                        self.back_up_external_edits and
+                        path in self.externally_edited_paths and
+                        os.path.exists(path)
+                    ):
+                        with open(path) as f:
+                            file_on_disk = f.read()
+                        with open(f"{path}.orig", "w") as f:
+                            f.write(file_on_disk)
+                    with open(path, "w") as f:
+                        f.write(content)
+                    self.written_files[path] = content
+                    self.file_stats[path] = self._file_stat(path)
+
+    def _changed_on_disk(self, path):
+        return (
+            path in self.file_stats and
+            os.path.exists(path) and
+            self.file_stats[path] != self._file_stat(path)
+        )
+
+    def _file_stat(self, path):
+        stat = os.stat(path)
+        return (stat.st_mtime_ns, stat.st_size)
+
+    def undo(self):
+        self.back_up_external_edits = True
+        try:
+            Immutable.undo(self)
+        finally:
+            self.back_up_external_edits = False
+
+    def redo(self):
+        self.back_up_external_edits = True
+        try:
+            Immutable.redo(self)
+        finally:
+            self.back_up_external_edits = False
+
+    def consolidate_changed_files(self):
+        if any(self._changed_on_disk(path) for path in list(self.file_stats)):
+            self.consolidate_files(only_changed=True)
 
-    def consolidate_files(self):
+    def consolidate_files(self, only_changed=False):
         with self.transaction():
             parts = self.collect_parts()
-            notes = set()
+            files_on_disk = {}
+            changed_files = []
             for (file, chunk) in parts.keys():
                 if file != tuple() and chunk == tuple():
-                    notes.update(self.consolidate(os.path.join(*file), file, chunk, parts))
+                    path = os.path.join(*file)
+                    if not os.path.exists(path):
+                        continue
+                    if only_changed and not self._changed_on_disk(path):
+                        continue
+                    with open(path) as f:
+                        files_on_disk[path] = f.read()
+                    self.file_stats[path] = self._file_stat(path)
+                    old_lines = []
+                    self.collect_lines(old_lines, file, chunk, parts)
+                    if files_on_disk[path] != "\n".join(x[1] for x in old_lines) + "\n":
+                        changed_files.append((old_lines, files_on_disk[path].splitlines()))
+                        if only_changed:
+                            self.externally_edited_paths.add(path)
+                    else:
+                        self.written_files[path] = files_on_disk[path]
+            notes = set()
+            for old_lines, new_lines in changed_files:
+                notes.update(self.consolidate(
+                    old_lines,
+                    new_lines,
+                    diff_opcodes([x[1] for x in old_lines], new_lines)
+                ))
             if notes:
                 parts = self.collect_parts()
                 report = [
                     "Consolidation report:",
                     "",
                 ]
+                failed = False
                 for (file, chunk) in parts.keys():
                     if file != tuple() and chunk == tuple():
                         path = os.path.join(*file)
-                        with open(path) as f:
-                            file_on_disk = f.read()
+                        if path not in files_on_disk:
+                            continue
+                        file_on_disk = files_on_disk[path]
                         file_in_memory = self.collect(file, chunk, parts)
                         if file_on_disk != file_in_memory:
+                            failed = True
                             report.append(f"  FAIL: {path}")
                             with open(f"{path}.orig", "w") as f:
                                 f.write(file_on_disk)
                         else:
                             report.append(f"  OK:   {path}")
+                            self.written_files[path] = file_on_disk
+                if only_changed and not failed:
+                    return
                 report_id = self.create_note(**{
                     "type": "code",
                     "text": "<code>",
@@ -2012,16 +2422,9 @@ class NoteDb(Immutable):
                 parts[key].append((note_id, note["fragments"]))
         return parts
 
-    def consolidate(self, path, file, chunk, parts):
-        if not os.path.exists(path):
-            return set()
-        old_lines = []
-        self.collect_lines(old_lines, file, chunk, parts)
-        with open(path) as f:
-            new_lines = f.read().splitlines()
-        sm = difflib.SequenceMatcher(a=[x[1] for x in old_lines], b=new_lines)
+    def consolidate(self, old_lines, new_lines, opcodes):
         note_actions = defaultdict(list)
-        for tag, i1, i2, j1, j2 in sm.get_opcodes():
+        for tag, i1, i2, j1, j2 in opcodes:
             if tag == "replace":
                 first = None
                 for tag, line in old_lines[i1:i2]:
@@ -2112,6 +2515,19 @@ class NoteDb(Immutable):
         return "\n".join(line[1] for line in lines) + "\n"
 
     def collect_lines(self, lines, file, chunk, parts, prefix="", blank_lines_before=0):
+        lines.extend(self._expand_chunk(file, chunk, parts, prefix, blank_lines_before)[0])
+
+    def _expand_chunk(self, file, chunk, parts, prefix, blank_lines_before):
+        key = (file, chunk, prefix, blank_lines_before)
+        if key in self.expanded_chunks:
+            lines, sources = self.expanded_chunks[key]
+            if all(
+                self._same_parts(parts.get(part_key, []), part)
+                for part_key, part in sources.items()
+            ):
+                return lines, sources
+        lines = []
+        sources = {(file, chunk): list(parts.get((file, chunk), []))}
         for index, (note_id, fragments) in enumerate(parts.get((file, chunk), [])):
             if index > 0:
                 for foo in range(blank_lines_before):
@@ -2123,25 +2539,38 @@ class NoteDb(Immutable):
                     else:
                         lines.append(((note_id, prefix, fragment_index), ""))
                 elif fragment["type"] == "chunk":
-                    self.collect_lines(
-                        lines,
+                    chunk_lines, chunk_sources = self._expand_chunk(
                         file,
                         tuple(list(chunk)+fragment["path"]),
                         parts,
-                        prefix=prefix+fragment["prefix"],
-                        blank_lines_before=fragment["blank_lines_before"],
+                        prefix+fragment["prefix"],
+                        fragment["blank_lines_before"],
                     )
+                    lines.extend(chunk_lines)
+                    sources.update(chunk_sources)
                 else:
                     raise ValueError(f"Unknown code fragment type {fragment['type']}")
+        if len(self.expanded_chunks) >= self.MAX_EXPANDED_CHUNKS:
+            self.expanded_chunks.clear()
+        self.expanded_chunks[key] = (lines, sources)
+        return lines, sources
+
+    def _same_parts(self, current, cached):
+        return len(current) == len(cached) and all(
+            current_note_id == cached_note_id and current_fragments is cached_fragments
+            for (current_note_id, current_fragments), (cached_note_id, cached_fragments)
+            in zip(current, cached)
+        )
 
     def get_notes(self, expression=""):
+        if not expression.strip():
+            return sorted(
+                self._get("notes").items(),
+                key=lambda item: item[1]["timestamp_created"],
+                reverse=True
+            )
         def match(item):
-            if item.get("type", "text") == "code":
-                lower_text = "".join(
-                    fragment.get("text", "") for fragment in item["fragments"]
-                ).lower()
-            else:
-                lower_text = item["text"].lower()
+            lower_text = note_search_text(item).lower()
             for part in expression.split(" "):
                 if part.startswith("#"):
                     tagpart = part[1:]
@@ -2154,16 +2583,33 @@ class NoteDb(Immutable):
                     if part.lower() not in lower_text:
                         return False
             return True
+        notes = self._get("notes")
+        candidate_ids = self.notes_file.candidate_note_ids(notes, [
+            part
+            for part in expression.split(" ")
+            if not part.startswith("#")
+        ])
+        if candidate_ids is None:
+            items = notes.items()
+        else:
+            items = (
+                (note_id, notes[note_id])
+                for note_id in candidate_ids
+                if note_id in notes
+            )
         return sorted(
             (
                 item
-                for item in self._get("notes").items()
+                for item in items
                 if match(item[1])
             ),
             key=lambda item: item[1]["timestamp_created"],
             reverse=True
         )
 
+    def has_note(self, note_id):
+        return note_id in self._get("notes")
+
     def get_note_data(self, note_id):
         self._ensure_note_id(note_id)
         return self._get("notes", note_id)
@@ -2184,7 +2630,7 @@ class NoteDb(Immutable):
             yield link["to"]
 
     def _create_virtual_links(self):
-        self.virtual_links = {}
+        virtual_links = {}
         code_notes = []
         parts = defaultdict(list)
         for note_id, note in reversed(self.get_notes()):
@@ -2199,28 +2645,40 @@ class NoteDb(Immutable):
                         tuple(note["filepath"]),
                         tuple(note["chunkpath"]+fragment["path"])
                     )]:
-                        self.virtual_links[genid()] = {
+                        virtual_links[genid()] = {
                             "from": note_id,
                             "to": child_note_id,
                             "timestamp_created": utcnow_timestamp_string(),
                             "virtual": True,
                         }
+        return virtual_links
 
     def get_outgoing_links(self, note_id):
-        return self._sort_links([
-            (link_id, link)
-            for link_id, link in self._links()
-            if link["from"] == note_id
-        ], sort_keys=["sort_index_in_from", "timestamp_created"])
+        return self._sort_links(
+            self._adjacency().get(note_id, ([], []))[0],
+            sort_keys=["sort_index_in_from", "timestamp_created"]
+        )
 
     def get_incoming_links(self, note_id):
-        return self._sort_links([
-            (link_id, link)
-            for link_id, link in self._links()
-            if link["to"] == note_id
-        ], sort_keys=["sort_index_in_to", "timestamp_created"])
+        return self._sort_links(
+            self._adjacency().get(note_id, ([], []))[1],
+            sort_keys=["sort_index_in_to", "timestamp_created"]
+        )
+
+    def _adjacency(self):
+        links = self._get("links")
+        if self.adjacency is None or self.adjacency[0] is not links:
+            adjacency = {}
+            for link_id, link in self._links():
+                adjacency.setdefault(link["from"], ([], []))[0].append((link_id, link))
+                adjacency.setdefault(link["to"], ([], []))[1].append((link_id, link))
+            self.adjacency = (links, adjacency)
+        return self.adjacency[1]
 
     def _links(self):
+        if self.virtual_links is None:
+            with STARTUP_PROFILER.phase("virtual links"):
+                self.virtual_links = self._create_virtual_links()
         yield from self._get("links").items()
         yield from self.virtual_links.items()
 
@@ -2259,16 +2717,19 @@ class NoteDb(Immutable):
         ))
 
     def delete_note(self, note_id):
-        self._ensure_note_id(note_id)
+        self.delete_notes([note_id])
+
+    def delete_notes(self, note_ids):
+        for note_id in note_ids:
+            self._ensure_note_id(note_id)
+        adjacency = self._adjacency()
         new_notes = dict(self._get("notes"))
-        new_notes.pop(note_id)
         new_links = dict(self._get("links"))
-        dead_links = []
-        for link_id, link in new_links.items():
-            if link["to"] == note_id or link["from"] == note_id:
-                dead_links.append(link_id)
-        for link_id in dead_links:
-            new_links.pop(link_id)
+        for note_id in note_ids:
+            new_notes.pop(note_id, None)
+            outgoing, incoming = adjacency.get(note_id, ([], []))
+            for link_id, link in outgoing + incoming:
+                new_links.pop(link_id, None)
         self._replace(notes=new_notes, links=new_links)
 
     def create_link(self, from_id, to_id):
@@ -2306,23 +2767,61 @@ class NoteDb(Immutable):
             raise ValueError(f"Invalid sort index end={end}.")
 
     def _move_link(self, link_id_to_move, end_keys, delta):
-        note_id = self._get("links", link_id_to_move)[end_keys["end_key"]]
-        links_to_sort = self._sort_links([
+        sort_index_key = end_keys["sort_index_key"]
+        links = self._get("links")
+        note_id = links[link_id_to_move][end_keys["end_key"]]
+        outgoing, incoming = self._adjacency()[note_id]
+        siblings = self._sort_links([
             (link_id, link)
-            for link_id, link in self._get("links").items()
-            if link[end_keys["end_key"]] == note_id
-        ], [end_keys["sort_index_key"], "timestamp_created"])
-        link_index = None
-        for index, (link_id, link) in enumerate(links_to_sort):
-            if link_id == link_id_to_move:
-                link_index = index
-        link = links_to_sort.pop(link_index)
-        links_to_sort.insert(max(0, link_index+delta), link)
-        new_links = dict(self._get("links"))
-        for index, (link_id, link) in enumerate(links_to_sort):
-            new_links[link_id] = dict(link, **{end_keys["sort_index_key"]: index})
-        if new_links != self._get("links"):
-            self._replace(links=new_links)
+            for link_id, link in (outgoing if end_keys["end_key"] == "from" else incoming)
+            if link_id in links
+        ], [sort_index_key, "timestamp_created"])
+        link_ids = [link_id for link_id, link in siblings]
+        index = link_ids.index(link_id_to_move)
+        new_index = min(max(0, index+delta), len(link_ids)-1)
+        if new_index == index:
+            return
+        link_ids.insert(new_index, link_ids.pop(index))
+        sort_indices = {
+            link_id: link.get(sort_index_key)
+            for link_id, link in siblings
+        }
+        new_sort_indices = self._new_sort_indices(link_ids, sort_indices, new_index)
+        new_links = dict(links)
+        for link_id, sort_index in new_sort_indices.items():
+            if sort_index != sort_indices[link_id]:
+                new_links[link_id] = dict(links[link_id], **{sort_index_key: sort_index})
+        self._replace(links=new_links)
+
+    def _new_sort_indices(self, link_ids, sort_indices, moved_index):
+        """
+        >>> db = NoteDb.__new__(NoteDb)
+        >>> db._new_sort_indices(["b", "a", "c"], {"a": 0, "b": 1024, "c": 2048}, 0)
+        {'b': -1024}
+        >>> db._new_sort_indices(["a", "c", "b"], {"a": 0, "b": 1024, "c": 2048}, 2)
+        {'b': 3072}
+        >>> db._new_sort_indices(["a", "c", "b", "d"], {"a": 0, "b": 1024, "c": 2048, "d": 3072}, 2)
+        {'b': 2560}
+        >>> db._new_sort_indices(["a", "c", "b"], {"a": 0, "b": 1, "c": 2}, 1)
+        {'a': 0, 'c': 1024, 'b': 2048}
+        """
+        if all(sort_indices[link_id] is not None for link_id in link_ids):
+            previous_index = None
+            next_index = None
+            if moved_index > 0:
+                previous_index = sort_indices[link_ids[moved_index-1]]
+            if moved_index < len(link_ids)-1:
+                next_index = sort_indices[link_ids[moved_index+1]]
+            if previous_index is None:
+                return {link_ids[moved_index]: next_index - self.SORT_INDEX_GAP}
+            elif next_index is None:
+                return {link_ids[moved_index]: previous_index + self.SORT_INDEX_GAP}
+            elif next_index - previous_index >= 2:
+                return {link_ids[moved_index]: (previous_index + next_index) // 2}
+        return {
+            link_id: index * self.SORT_INDEX_GAP
+            for index, link_id in enumerate(link_ids)
+        }
 
     def _ensure_note_id(self, note_id):
         if note_id not in self._get("notes"):
@@ -2336,9 +2835,348 @@ class NoteDb(Immutable):
         self._set(dict(self._get(), **kwargs))
 
     def _data_changed(self):
-        write_json_file(self.path, self._get())
+        self.notes_file.write(self._get())
         self.write_files()
-        self._create_virtual_links()
+        self.virtual_links = None
+        self.adjacency = None
+
+class JsonNotesFile(object):
+
+    EXTENSION = ".notes"
+
+    def __init__(self, path):
+        self.path = path
+
+    def read(self, default_value):
+        return read_json_file(self.path, default_value)
+
+    def write(self, data):
+        write_json_file(self.path, data)
+
+    def candidate_note_ids(self, notes, words):
+        return None
+
+class SnapshotNotesFile(JsonNotesFile):
+
+    """
+    A compact binary snapshot of the same data as the JSON format. After a
+    magic line, each top level key is stored as one record: a 4 byte big
+    endian length followed by zlib compressed compact JSON of [key, value].
+
+    >>> with tempfile.TemporaryDirectory() as tmp_dir:
+    ...     path = os.path.join(tmp_dir, "test.snapshot")
+    ...     data = {"version": 1, "notes": {"a": {"text": "hello", "tags": []}}, "links": {}}
+    ...     SnapshotNotesFile(path).write(data)
+    ...     SnapshotNotesFile(path).read(None) == data
+    True
+    """
+
+    EXTENSION = ".snapshot"
+
+    MAGIC = b"SMARTNOTES SNAPSHOT 2\n"
+
+    RECORD_LENGTH = struct.Struct(">I")
+
+    def read(self, default_value):
+        if not os.path.exists(self.path):
+            return default_value
+        with open(self.path, "rb") as f:
+            content = f.read()
+        if not content.startswith(self.MAGIC):
+            raise ValueError(f"{self.path} is not a snapshot file")
+        data = {}
+        offset = len(self.MAGIC)
+        while offset < len(content):
+            (length,) = self.RECORD_LENGTH.unpack_from(content, offset)
+            offset += self.RECORD_LENGTH.size
+            key, value = json.loads(zlib.decompress(content[offset:offset+length]))
+            data[key] = value
+            offset += length
+        return data
+
+    def write(self, data):
+        with safe_write(self.path, mode="wb") as f:
+            f.write(self.MAGIC)
+            for key in sorted(data):
+                record = zlib.compress(json.dumps(
+                    [key, data[key]],
+                    ensure_ascii=False,
+                    separators=(",", ":")
+                ).encode("utf-8"), 1)
+                f.write(self.RECORD_LENGTH.pack(len(record)))
+                f.write(record)
+
+class SqliteNotesFile(JsonNotesFile):
+
+    """
+    Notes and links stored as rows in an SQLite database. Only rows whose
+    data changed since the last write are written.
+
+    >>> tmp_dir = tempfile.TemporaryDirectory()
+    >>> path = os.path.join(tmp_dir.name, "test.sqlite")
+    >>> notes_file = SqliteNotesFile(path)
+    >>> data = {
+    ...     "version": 1,
+    ...     "notes": {"a": {"text": "Hello world"}, "b": {"text": "Goodbye"}, "c": {"text": "World"}},
+    ...     "links": {"l": {"from": "a", "to": "b"}},
+    ... }
+    >>> notes_file.write(data)
+    >>> data = dict(data, notes={"a": data["notes"]["a"], "b": {"text": "Goodbye world"}})
+    >>> notes_file.write(data)
+    >>> reopened = SqliteNotesFile(path)
+    >>> reopened.read(None) == data
+    True
+    >>> reopened.close()
+
+    If the text index is available, it finds candidate notes for words:
+
+    >>> notes_file.has_text_index is False or (
+    ...     sorted(notes_file.candidate_note_ids(data["notes"], ["WORLD"])) == ["a", "b"]
+    ... )
+    True
+    >>> notes_file.close()
+    >>> tmp_dir.cleanup()
+    """
+
+    EXTENSION = ".sqlite"
+
+    def __init__(self, path):
+        JsonNotesFile.__init__(self, path)
+        self.connection = None
+        self.has_text_index = False
+        self.persisted = {"notes": {}, "links": {}}
+        self.rowids = {}
+        self.next_rowid = 1
+
+    def read(self, default_value):
+        if not os.path.exists(self.path):
+            return default_value
+        self._connect()
+        data = {}
+        for key, value in self.connection.execute("SELECT key, value FROM meta"):
+            data[key] = json.loads(value)
+        data["notes"] = {
+            note_id: json.loads(note)
+            for note_id, note
+            in self.connection.execute("SELECT id, data FROM notes")
+        }
+        data["links"] = {
+            link_id: json.loads(link)
+            for link_id, link
+            in self.connection.execute("SELECT id, data FROM links")
+        }
+        self.persisted = data
+        if self.has_text_index:
+            self._rebuild_text_index_if_stale(data["notes"])
+        return data
+
+    def write(self, data):
+        self._connect()
+        with self.connection:
+            for key, value in data.items():
+                if key not in ("notes", "links") and self.persisted.get(key) != value:
+                    self.connection.execute(
+                        "INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)",
+                        (key, json.dumps(value))
+                    )
+            changed_notes, deleted_notes = self._changed_rows("notes", data)
+            stale_rowids = [
+                self.rowids[note_id]
+                for note_id in deleted_notes+[x for x, _ in changed_notes]
+                if note_id in self.rowids
+            ]
+            for note_id in deleted_notes:
+                self.rowids.pop(note_id)
+            for note_id, note in changed_notes:
+                if note_id not in self.rowids:
+                    self.rowids[note_id] = self.next_rowid
+                    self.next_rowid += 1
+            self.connection.executemany(
+                "DELETE FROM notes WHERE id = ?",
+                ((note_id,) for note_id in deleted_notes)
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO notes (rowid, id, data) VALUES (?, ?, ?)",
+                (
+                    (self.rowids[note_id], note_id, json.dumps(note))
+                    for note_id, note in changed_notes
+                )
+            )
+            if self.has_text_index:
+                self.connection.executemany(
+                    "DELETE FROM note_text WHERE rowid = ?",
+                    ((rowid,) for rowid in stale_rowids)
+                )
+                self.connection.executemany(
+                    "INSERT INTO note_text (rowid, text) VALUES (?, ?)",
+                    (
+                        (self.rowids[note_id], note_search_text(note))
+                        for note_id, note in changed_notes
+                    )
+                )
+            changed_links, deleted_links = self._changed_rows("links", data)
+            self.connection.executemany(
+                "DELETE FROM links WHERE id = ?",
+                ((link_id,) for link_id in deleted_links)
+            )
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO links (id, from_id, to_id, data) VALUES (?, ?, ?, ?)",
+                (
+                    (link_id, link["from"], link["to"], json.dumps(link))
+                    for link_id, link in changed_links
+                )
+            )
+        self.persisted = data
+
+    def close(self):
+        if self.connection is not None:
+            self.connection.close()
+            self.connection = None
+
+    def candidate_note_ids(self, notes, words):
+        words = [word for word in words if len(word) >= 3]
+        if not self.has_text_index or not words or notes is not self.persisted["notes"]:
+            return None
+        candidate_ids = None
+        for word in words:
+            ids = {
+                note_id
+                for (note_id,)
+                in self.connection.execute(
+                    "SELECT notes.id FROM note_text "
+                    "JOIN notes ON notes.rowid = note_text.rowid "
+                    "WHERE note_text MATCH ?",
+                    ('"{}"'.format(word.replace('"', '""')),)
+                )
+            }
+            if candidate_ids is None:
+                candidate_ids = ids
+            else:
+                candidate_ids &= ids
+        return candidate_ids
+
+    def _changed_rows(self, table, data):
+        old = self.persisted[table]
+        new = data[table]
+        if old is new:
+            return [], []
+        changed = [
+            (row_id, row)
+            for row_id, row in new.items()
+            if old.get(row_id) is not row
+        ]
+        deleted = [row_id for row_id in old if row_id not in new]
+        return changed, deleted
+
+    def _connect(self):
+        if self.connection is not None:
+            return
+        self.connection = sqlite3.connect(self.path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute("PRAGMA synchronous = NORMAL")
+        with self.connection:
+            self.connection.executescript("""
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT);
+                CREATE TABLE IF NOT EXISTS notes (id TEXT PRIMARY KEY, data TEXT);
+                CREATE TABLE IF NOT EXISTS links (
+                    id TEXT PRIMARY KEY,
+                    from_id TEXT,
+                    to_id TEXT,
+                    data TEXT
+                );
+                CREATE INDEX IF NOT EXISTS links_from ON links (from_id);
+                CREATE INDEX IF NOT EXISTS links_to ON links (to_id);
+            """)
+            try:
+                self.connection.execute(
+                    "CREATE VIRTUAL TABLE IF NOT EXISTS note_text "
+                    "USING fts5(text, tokenize='trigram')"
+                )
+                self.has_text_index = True
+            except sqlite3.OperationalError:
+                self.has_text_index = False
+        self.rowids = {
+            note_id: rowid
+            for rowid, note_id
+            in self.connection.execute("SELECT rowid, id FROM notes")
+        }
+        self.next_rowid = max(self.rowids.values(), default=0) + 1
+
+    def _rebuild_text_index_if_stale(self, notes):
+        (count,) = self.connection.execute("SELECT count(*) FROM note_text").fetchone()
+        if count != len(notes):
+            with self.connection:
+                self.connection.execute("DELETE FROM note_text")
+                self.connection.executemany(
+                    "INSERT INTO note_text (rowid, text) VALUES (?, ?)",
+                    (
+                        (self.rowids[note_id], note_search_text(note))
+                        for note_id, note in notes.items()
+                    )
+                )
+
+NOTES_FILE_TYPES = [JsonNotesFile, SnapshotNotesFile, SqliteNotesFile]
+
+def open_notes_file(path):
+    """
+    >>> open_notes_file("smartnotes.snapshot").__class__.__name__
+    'SnapshotNotesFile'
+    >>> open_notes_file("smartnotes.notes").__class__.__name__
+    'JsonNotesFile'
+    """
+    for notes_file_type in NOTES_FILE_TYPES:
+        if path.endswith(notes_file_type.EXTENSION):
+            return notes_file_type(path)
+    return JsonNotesFile(path)
+
+def convert_notes_file(source, destination):
+    data = open_notes_file(source).read(None)
+    if data is None:
+        sys.exit(f"{source} does not exist")
+    open_notes_file(destination).write(data)
+    if open_notes_file(destination).read(None) != data:
+        sys.exit(f"{destination} does not round-trip {source}")
+
+def benchmark_notes_files(path, repeat=5):
+    data = open_notes_file(path).read(None)
+    if data is None:
+        sys.exit(f"{path} does not exist")
+    print(f"{len(data['notes'])} notes, {len(data['links'])} links")
+    note_id, note = next(iter(data["notes"].items()))
+    updated_data = dict(data, notes=dict(data["notes"], **{
+        note_id: dict(note, timestamp_created=utcnow_timestamp_string())
+    }))
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        for notes_file_type in NOTES_FILE_TYPES:
+            save_times = []
+            load_times = []
+            update_times = []
+            for index in range(repeat):
+                path = os.path.join(
+                    tmp_dir,
+                    f"benchmark{index}{notes_file_type.EXTENSION}"
+                )
+                start = time.perf_counter()
+                notes_file_type(path).write(data)
+                save_times.append(time.perf_counter() - start)
+                notes_file = notes_file_type(path)
+                start = time.perf_counter()
+                loaded = notes_file.read(None)
+                load_times.append(time.perf_counter() - start)
+                assert loaded == data
+                start = time.perf_counter()
+                notes_file.write(dict(updated_data, notes=dict(
+                    loaded["notes"],
+                    **{note_id: updated_data["notes"][note_id]}
+                )))
+                update_times.append(time.perf_counter() - start)
+            print("{:<20} size = {:>10} bytes | load = {:8.1f}ms | save = {:8.1f}ms | update one note = {:8.1f}ms".format(
+                notes_file_type.__name__,
+                os.path.getsize(path),
+                min(load_times)*1000,
+                min(save_times)*1000,
+                min(update_times)*1000
+            ))
 
 class NoteNotFound(ValueError):
     pass
@@ -2369,41 +3207,53 @@ class NoteText(ExternalTextEntry):
     CHUNKPATH_PREFIX = "chunkpath: "
     SPLIT_SYNAX = "<<SPLIT>>"
 
+    FOOTER_FIELD_PATTERN = re.compile("({}|{}|{}|{})(.*)".format(
+        re.escape(LINK_PREFIX),
+        re.escape(TAG_PREFIX),
+        re.escape(FILEPATH_PREFIX),
+        re.escape(CHUNKPATH_PREFIX),
+    ))
+    CHUNK_PATTERN = re.compile(r'(.*)<<(.*), blank_lines_before=(\d+)>>')
+
     def __init__(self, db, note_id=None):
         self.db = db
         self.note_id = note_id
+        self.split_note_ids = []
         ExternalTextEntry.__init__(self, self._note_to_text(), EDITOR_COMMAND)
 
     def _note_to_text(self):
-        data = self.db.get_note_data(self.note_id)
+        return self._note_data_to_text(self.db.get_note_data(self.note_id))
+
+    @classmethod
+    def _note_data_to_text(cls, data):
         links = data.get("links", [])
         tags = data.get("tags", [])
         extra = []
         extra.append("\n")
         extra.append("--\n")
         for link in links:
-            extra.append("{}{}\n".format(self.LINK_PREFIX, link))
+            extra.append("{}{}\n".format(cls.LINK_PREFIX, link))
         for tag in tags:
-            extra.append("{}{}\n".format(self.TAG_PREFIX, tag))
+            extra.append("{}{}\n".format(cls.TAG_PREFIX, tag))
         if data.get("type", "text") == "code":
-            extra.append("{}{}\n".format(self.FILEPATH_PREFIX, "/".join(data["filepath"])))
-            extra.append("{}{}\n".format(self.CHUNKPATH_PREFIX, "/".join(data["chunkpath"])))
+            extra.append("{}{}\n".format(cls.FILEPATH_PREFIX, "/".join(data["filepath"])))
+            extra.append("{}{}\n".format(cls.CHUNKPATH_PREFIX, "/".join(data["chunkpath"])))
         extra.append("# Usage:\n")
-        extra.append("# {}http://...\n".format(self.LINK_PREFIX))
-        extra.append("# {}name\n".format(self.TAG_PREFIX))
-        extra.append("# {}foo/bar.py\n".format(self.FILEPATH_PREFIX))
-        extra.append("# {}classes/Foo\n".format(self.CHUNKPATH_PREFIX))
+        extra.append("# {}http://...\n".format(cls.LINK_PREFIX))
+        extra.append("# {}name\n".format(cls.TAG_PREFIX))
+        extra.append("# {}foo/bar.py\n".format(cls.FILEPATH_PREFIX))
+        extra.append("# {}classes/Foo\n".format(cls.CHUNKPATH_PREFIX))
         extra.append("#\n")
         extra.append("# Code Syntax:\n")
         extra.append("# <<foo, blank_lines_before=1>>\n")
-        extra.append("# {}\n".format(self.SPLIT_SYNAX))
+        extra.append("# {}\n".format(cls.SPLIT_SYNAX))
         extra.append("#\n")
         extra.append("# Tags with special formatting:\n")
         for tag in TAG_ATTRIBUTES:
-            extra.append("# {}{}\n".format(self.TAG_PREFIX, tag["name"]))
+            extra.append("# {}{}\n".format(cls.TAG_PREFIX, tag["name"]))
         extra.append("--\n")
         if data.get("type", "text") == "code":
-            return self._code_fragments_to_text(data["fragments"]) + "".join(extra)
+            return cls._code_fragments_to_text(data["fragments"]) + "".join(extra)
         else:
             return data["text"] + "".join(extra)
 
@@ -2412,15 +3262,33 @@ class NoteText(ExternalTextEntry):
             fields = self._text_to_note_fields()
             if "splits" in fields:
                 splits = fields.pop("splits")
-                self.db.update_note(self.note_id, **dict(fields, fragments=splits[0]))
-                for fragments in splits[1:]:
-                    self.db.create_note(**dict(fields, fragments=fragments, text="<code>"))
+                self._update_changed_fields(self.note_id, dict(fields, fragments=splits[0]))
+                for index, fragments in enumerate(splits[1:]):
+                    split_fields = dict(fields, fragments=fragments, text="<code>")
+                    if index < len(self.split_note_ids) and self.db.has_note(self.split_note_ids[index]):
+                        self._update_changed_fields(self.split_note_ids[index], split_fields)
+                    else:
+                        note_id = self.db.create_note(**split_fields)
+                        if index < len(self.split_note_ids):
+                            self.split_note_ids[index] = note_id
+                        else:
+                            self.split_note_ids.append(note_id)
             else:
-                self.db.update_note(self.note_id, **fields)
+                self._update_changed_fields(self.note_id, fields)
+
+    def _update_changed_fields(self, note_id, fields):
+        data = self.db.get_note_data(note_id)
+        changed_fields = {
+            key: value
+            for key, value in fields.items()
+            if key not in data or data[key] != value
+        }
+        if changed_fields:
+            self.db.update_note(note_id, **changed_fields)
 
     def _text_to_note_fields(self):
         try:
-            return self._parse_footer()
+            return self._parse_footer(self.text)
         except ParseError:
             return {
                 "text": self.text,
@@ -2428,7 +3296,8 @@ class NoteText(ExternalTextEntry):
                 "tags": [],
             }
 
-    def _code_fragments_to_text(self, fragments):
+    @classmethod
+    def _code_fragments_to_text(cls, fragments):
         lines = []
         for fragment in fragments:
             if fragment["type"] == "chunk":
@@ -2443,77 +3312,149 @@ class NoteText(ExternalTextEntry):
                 ))
         return "\n".join(lines) + "\n"
 
-    def _text_to_code_fragments(self, text):
-        splits = [[]]
+    @classmethod
+    def _text_to_code_fragments(cls, text):
+        fragments = []
+        splits = [fragments]
         for line in text.splitlines():
-            if line == self.SPLIT_SYNAX:
-                splits.append([])
-            else:
-                match = re.match(r'^(.*)<<(.*), blank_lines_before=(\d+)>>$', line)
+            if line == cls.SPLIT_SYNAX:
+                fragments = []
+                splits.append(fragments)
+                continue
+            if line.endswith(">>"):
+                match = cls.CHUNK_PATTERN.fullmatch(line)
                 if match:
-                    splits[-1].append({
+                    fragments.append({
                         "type": "chunk",
                         "prefix": match.group(1),
                         "path": match.group(2).split("/"),
                         "blank_lines_before": int(match.group(3))
                     })
-                else:
-                    splits[-1].append({"type": "line", "text": line})
+                    continue
+            fragments.append({"type": "line", "text": line})
         return splits
 
-    def _parse_footer(self):
+    @classmethod
+    def _parse_footer(cls, text):
+        """
+        Parsing the text of a note gives back its fields:
+
+        >>> rng = random.Random(0)
+        >>> for _ in range(200):
+        ...     data = random_note_data(rng, rng.randint(0, 10))
+        ...     expected = dict(data)
+        ...     if "fragments" in expected:
+        ...         expected["splits"] = [expected.pop("fragments")]
+        ...     assert NoteText._parse_footer(NoteText._note_data_to_text(data)) == expected, data
+
+        >>> NoteText._parse_footer("hello\\n")
+        Traceback (most recent call last):
+          ...
+        ParseError: no footer found
+
+        >>> NoteText._parse_footer("hello\\n--\\nfoo\\n--\\n")
+        Traceback (most recent call last):
+          ...
+        ParseError: unknown field
+        """
+        lines = text.splitlines(True)
+        start = len(lines) - 2
+        if start < 0 or lines[-1].rstrip() != "--":
+            raise ParseError("no footer found")
+        while start >= 0 and lines[start].rstrip() != "--":
+            start -= 1
+        if start < 0:
+            raise ParseError("no footer found")
         data = {
-            "text": "",
             "links": [],
             "tags": [],
-            "filepath": [],
-            "chunkpath": [],
         }
-        parts = self.text.splitlines(True)
-        if parts and parts.pop(-1).rstrip() == "--":
-            while parts and parts[-1].rstrip() != "--":
-                part = parts.pop(-1)
-                if part.startswith(self.LINK_PREFIX):
-                    data["links"].insert(0, part[len(self.LINK_PREFIX):].rstrip())
-                elif part.startswith(self.TAG_PREFIX):
-                    data["tags"].insert(0, part[len(self.TAG_PREFIX):].rstrip())
-                elif part.startswith(self.FILEPATH_PREFIX):
-                    data["filepath"] = [
-                        x
-                        for x
-                        in part[len(self.FILEPATH_PREFIX):].rstrip().split("/")
-                        if x
-                    ]
-                elif part.startswith(self.CHUNKPATH_PREFIX):
-                    data["chunkpath"] = [
-                        x
-                        for x
-                        in part[len(self.CHUNKPATH_PREFIX):].rstrip().split("/")
-                        if x
-                    ]
-                elif part.startswith("#"):
-                    pass
-                else:
+        paths = {}
+        for index in range(start+1, len(lines)-1):
+            match = cls.FOOTER_FIELD_PATTERN.match(lines[index])
+            if match is None:
+                if not lines[index].startswith("#"):
                     raise ParseError("unknown field")
-            if parts:
-                parts.pop(-1)
-                while parts and parts[-1].strip() == "":
-                    parts.pop(-1)
-                data["text"] = "".join(parts)
-                if data["filepath"] or data["chunkpath"]:
-                    data["type"] = "code"
-                    data["splits"] = self._text_to_code_fragments(data["text"])
-                    data.pop("text")
-                else:
-                    data["type"] = "text"
-                    data.pop("filepath")
-                    data.pop("chunkpath")
-                return data
-        raise ParseError("no footer found")
+            elif match.group(1) == cls.LINK_PREFIX:
+                data["links"].append(match.group(2).rstrip())
+            elif match.group(1) == cls.TAG_PREFIX:
+                data["tags"].append(match.group(2).rstrip())
+            elif match.group(1) not in paths:
+                paths[match.group(1)] = [
+                    x
+                    for x
+                    in match.group(2).rstrip().split("/")
+                    if x
+                ]
+        while start > 0 and lines[start-1].strip() == "":
+            start -= 1
+        text = "".join(lines[:start])
+        filepath = paths.get(cls.FILEPATH_PREFIX, [])
+        chunkpath = paths.get(cls.CHUNKPATH_PREFIX, [])
+        if filepath or chunkpath:
+            data["type"] = "code"
+            data["filepath"] = filepath
+            data["chunkpath"] = chunkpath
+            data["splits"] = cls._text_to_code_fragments(text)
+        else:
+            data["type"] = "text"
+            data["text"] = text
+        return data
 
 class ParseError(ValueError):
     pass
 
+def random_note_data(rng, line_count):
+    words = ["foo", "bar", "<<", ">>", "--", "#", "link:", "", " "]
+    lines = [
+        " ".join(rng.choice(words) for _ in range(rng.randint(0, 4)))
+        for _ in range(line_count)
+    ] + ["end"]
+    data = {
+        "links": [f"https://example.com/{rng.randint(0, 9)}" for _ in range(rng.randint(0, 2))],
+        "tags": rng.sample(["foo", "bar", "title"], rng.randint(0, 3)),
+    }
+    if rng.random() < 0.5:
+        data["type"] = "text"
+        data["text"] = "\n".join(lines) + "\n"
+    else:
+        data["type"] = "code"
+        data["filepath"] = rng.sample(["src", "foo.py"], rng.randint(0, 2))
+        data["chunkpath"] = rng.sample(["classes", "Foo"], 0 if data["filepath"] else rng.randint(1, 2))
+        data["fragments"] = []
+        for line in lines:
+            if rng.random() < 0.1:
+                data["fragments"].append({
+                    "type": "chunk",
+                    "prefix": rng.choice(["", "    "]),
+                    "path": rng.sample(["a", "b", "c"], rng.randint(1, 3)),
+                    "blank_lines_before": rng.randint(0, 2),
+                })
+            data["fragments"].append({"type": "line", "text": line})
+    return data
+
+def benchmark_note_text_parser(line_counts=[1000, 10000, 100000], repeat=5):
+    rng = random.Random(0)
+    for line_count in line_counts:
+        data = random_note_data(rng, line_count)
+        while data["type"] != "code":
+            data = random_note_data(rng, line_count)
+        lines = NoteText._code_fragments_to_text(data["fragments"]).splitlines(True)
+        for index in range(len(lines)//100, len(lines), len(lines)//100 or 1):
+            lines[index] = lines[index] + NoteText.SPLIT_SYNAX + "\n"
+        text = "".join(lines) + NoteText._note_data_to_text(dict(data, fragments=[]))[1:]
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            fields = NoteText._parse_footer(text)
+            times.append(time.perf_counter() - start)
+        print("{:>8} lines | {:>4} splits | parse = {:8.1f}ms | {:6.2f}us/line".format(
+            text.count("\n"),
+            len(fields["splits"]),
+            min(times)*1000,
+            min(times)*1000000/text.count("\n")
+        ))
+
 class Animation(object):
 
     def __init__(self):
@@ -2547,6 +3488,10 @@ class Animation(object):
 
 class PygameWindow(WindowFocusMixin):
 
+    def __init__(self):
+        WindowFocusMixin.__init__(self)
+        self.coalesced_event_count = 0
+
     def set_title(self, title):
         pygame.display.set_caption(title)
 
@@ -2555,8 +3500,19 @@ class PygameWindow(WindowFocusMixin):
 
 class PygameEvent(object):
 
+    key_bindings = {}
+
     def __init__(self, event):
         self.event = event
+        if event.type == pygame.KEYDOWN:
+            self.key_binding = (
+                event.key,
+                bool(event.mod & pygame.KMOD_CTRL),
+                bool(event.mod & pygame.KMOD_SHIFT),
+                bool(event.mod & pygame.KMOD_ALT),
+            )
+        else:
+            self.key_binding = None
 
     def mouse_motion(self, rect=None):
         return (
@@ -2590,29 +3546,46 @@ class PygameEvent(object):
     def key_down(self, description=None):
         if description is None:
             return self.event.type == pygame.KEYDOWN
-        parts = description.split("+")
-        ctrl = False
-        shift = False
-        alt = False
-        while parts:
-            part = parts.pop(0)
-            if part == "ctrl":
-                ctrl = True
-            elif part == "shift":
-                shift = True
-            elif part == "alt":
-                alt = True
-            elif not parts:
-                key = pygame.key.key_code(part)
-            else:
-                raise ValueError("unknown part {}".format(part))
-        return (
-            self.event.type == pygame.KEYDOWN and
-            self.event.key == key and
-            bool(self.event.mod & pygame.KMOD_CTRL) == ctrl and
-            bool(self.event.mod & pygame.KMOD_SHIFT) == shift and
-            bool(self.event.mod & pygame.KMOD_ALT) == alt
-        )
+        return self.key_binding == self.compile_key_binding(description)
+
+    def key_down_handler(self, key_handlers):
+        return key_handlers.get(self.key_binding)
+
+    @classmethod
+    def compile_key_handlers(cls, handlers):
+        return {
+            cls.compile_key_binding(description): handler
+            for description, handler
+            in handlers.items()
+        }
+
+    @classmethod
+    def compile_key_binding(cls, description):
+        """
+        >>> PygameEvent.compile_key_binding("ctrl+super+a")
+        Traceback (most recent call last):
+          ...
+        ValueError: unknown part super
+        """
+        if description not in cls.key_bindings:
+            parts = description.split("+")
+            ctrl = False
+            shift = False
+            alt = False
+            while parts:
+                part = parts.pop(0)
+                if part == "ctrl":
+                    ctrl = True
+                elif part == "shift":
+                    shift = True
+                elif part == "alt":
+                    alt = True
+                elif not parts:
+                    key = pygame.key.key_code(part)
+                else:
+                    raise ValueError("unknown part {}".format(part))
+            cls.key_bindings[description] = (key, ctrl, shift, alt)
+        return cls.key_bindings[description]
 
     def window_gained_focus(self):
         return (
@@ -2635,12 +3608,44 @@ class ExternalTextEntries(object):
 
     def add(self, entry):
         self.entries.append(entry)
+        entry.start_watching()
 
-    def check(self):
-        self.entries = [
-            entry
-            for entry in self.entries
-            if entry.check()
+    def check(self, entry):
+        if entry in self.entries and not entry.check():
+            self.entries.remove(entry)
+
+class SpatialIndex:
+
+    """
+    A uniform grid of rects for finding the items under a point without
+    testing every rect.
+
+    >>> index = SpatialIndex(cell_size=10)
+    >>> index.add(pygame.Rect(0, 0, 15, 15), "a")
+    >>> index.add(pygame.Rect(12, 12, 20, 20), "b")
+    >>> index.query((5, 5))
+    ['a']
+    >>> index.query((13, 14))
+    ['a', 'b']
+    >>> index.query((100, 100))
+    []
+    """
+
+    def __init__(self, cell_size=64):
+        self.cell_size = cell_size
+        self.cells = defaultdict(list)
+
+    def add(self, rect, item):
+        for x in range(rect.left // self.cell_size, (rect.right-1) // self.cell_size + 1):
+            for y in range(rect.top // self.cell_size, (rect.bottom-1) // self.cell_size + 1):
+                self.cells[(x, y)].append((rect, item))
+
+    def query(self, pos):
+        return [
+            item
+            for rect, item
+            in self.cells.get((pos[0] // self.cell_size, pos[1] // self.cell_size), [])
+            if rect.collidepoint(pos)
         ]
 
 class RawText:
@@ -2679,6 +3684,14 @@ class RawText:
         lines.append(" ".join(word_buffer))
         return [x for x in lines if x]
 
+def note_search_text(note):
+    if note.get("type", "text") == "code":
+        return "".join(
+            fragment.get("text", "") for fragment in note["fragments"]
+        )
+    else:
+        return note["text"]
+
 def genid():
     return uuid.uuid4().hex
 
@@ -2697,9 +3710,9 @@ def write_json_file(path, value):
         json.dump(value, f, indent=4, sort_keys=True)
 
 @contextlib.contextmanager
-def safe_write(path):
+def safe_write(path, mode="w"):
     tmp_path = f"{path}.tmp"
-    with open(tmp_path, "w") as f:
+    with open(tmp_path, mode) as f:
         yield f
     os.rename(tmp_path, path)
 
@@ -2710,6 +3723,234 @@ def format_title(name, path):
         name
     )
 
+def best_grid(count, width, height, cell_width, cell_height):
+    """
+    Find the number of columns and rows that lets count cells of the given
+    size be as large as possible (but not larger than their size) when the
+    grid is fitted inside width x height.
+
+    Only the distinct column counts (at most about 2*sqrt(count) of them)
+    need to be tried since any other row count leaves an empty row.
+
+    >>> best_grid(6, 600, 200, 100, 60)
+    (6, 1, 1)
+    >>> best_grid(4, 200, 200, 100, 100)
+    (2, 2, 1)
+    >>> columns, rows, scale = best_grid(7, 100, 100, 100, 100)
+    >>> (columns, rows, round(scale, 3))
+    (3, 3, 0.333)
+    """
+    best = None
+    rows = 1
+    while rows <= count:
+        columns = math.ceil(count / rows)
+        rows = math.ceil(count / columns)
+        scale = min(1, width / (cell_width*columns), height / (cell_height*rows))
+        if best is None or scale > best[2]:
+            best = (columns, rows, scale)
+        if columns == 1:
+            break
+        rows = math.ceil(count / (columns-1))
+    return best
+
+def mouse_event_pos(event):
+    if event.mouse_motion() or event.left_mouse_down() or event.left_mouse_up():
+        return event.mouse_pos()
+    return None
+
+def coalesce_mouse_motion(events):
+    """
+    Merge runs of consecutive mouse motion events into one, keeping the
+    last position and the summed relative motion. Returns the new list of
+    events and how many were dropped.
+
+    >>> events, dropped = coalesce_mouse_motion([
+    ...     pygame.event.Event(pygame.MOUSEMOTION, pos=(1, 1), rel=(1, 1), buttons=(0, 0, 0)),
+    ...     pygame.event.Event(pygame.MOUSEMOTION, pos=(3, 2), rel=(2, 1), buttons=(0, 0, 0)),
+    ...     pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=(3, 2), button=1),
+    ...     pygame.event.Event(pygame.MOUSEMOTION, pos=(4, 2), rel=(1, 0), buttons=(1, 0, 0)),
+    ... ])
+    >>> dropped
+    1
+    >>> [(pygame.event.event_name(event.type), event.pos) for event in events]
+    [('MouseMotion', (3, 2)), ('MouseButtonDown', (3, 2)), ('MouseMotion', (4, 2))]
+    >>> events[0].rel
+    (3, 2)
+    """
+    result = []
+    dropped = 0
+    for event in events:
+        if (event.type == pygame.MOUSEMOTION and
+                result and result[-1].type == pygame.MOUSEMOTION):
+            previous = result.pop()
+            attributes = dict(event.dict)
+            attributes["rel"] = (
+                previous.rel[0] + event.rel[0],
+                previous.rel[1] + event.rel[1],
+            )
+            result.append(pygame.event.Event(pygame.MOUSEMOTION, attributes))
+            dropped += 1
+        else:
+            result.append(event)
+    return result, dropped
+
+def diff_opcodes(a, b):
+    """
+    Opcodes like difflib.SequenceMatcher.get_opcodes, computed with a
+    patience diff: common prefix and suffix are trimmed, lines that are
+    unique on both sides anchor the diff, and the regions between anchors
+    are diffed the same way. Regions without anchors are diffed with
+    myers_matches and become one replace if they differ too much.
+
+    >>> diff_opcodes(["a", "b", "c", "d"], ["a", "x", "c", "d", "e"])
+    [('equal', 0, 1, 0, 1), ('replace', 1, 2, 1, 2), ('equal', 2, 4, 2, 4), ('insert', 4, 4, 4, 5)]
+    >>> diff_opcodes(["}", "x", "}", "y", "}"], ["}", "y", "}"])
+    [('equal', 0, 1, 0, 1), ('delete', 1, 3, 1, 1), ('equal', 3, 5, 1, 3)]
+
+    The opcodes always turn a into b:
+
+    >>> rng = random.Random(0)
+    >>> for _ in range(500):
+    ...     a = [rng.choice(["}", "x", "y", ""]) for _ in range(rng.randint(0, 30))]
+    ...     b = list(a)
+    ...     for _ in range(rng.randint(0, 5)):
+    ...         index = rng.randint(0, len(b))
+    ...         b[index:index+rng.randint(0, 3)] = rng.choice(["}", "x", "z"]) * rng.randint(0, 3)
+    ...     rebuilt = []
+    ...     i = j = 0
+    ...     for tag, i1, i2, j1, j2 in diff_opcodes(a, b):
+    ...         assert (i, j) == (i1, j1)
+    ...         assert tag != "equal" or a[i1:i2] == b[j1:j2]
+    ...         rebuilt.extend(b[j1:j2])
+    ...         i, j = i2, j2
+    ...     assert (i, j, rebuilt) == (len(a), len(b), b), (a, b)
+    """
+    matches = []
+    regions = [(0, len(a), 0, len(b))]
+    while regions:
+        alo, ahi, blo, bhi = regions.pop()
+        while alo < ahi and blo < bhi and a[alo] == b[blo]:
+            matches.append((alo, blo))
+            alo += 1
+            blo += 1
+        while alo < ahi and blo < bhi and a[ahi-1] == b[bhi-1]:
+            ahi -= 1
+            bhi -= 1
+            matches.append((ahi, bhi))
+        if alo == ahi or blo == bhi:
+            continue
+        anchors = patience_anchors(a, alo, ahi, b, blo, bhi)
+        if anchors:
+            for i, j in anchors:
+                matches.append((i, j))
+                regions.append((alo, i, blo, j))
+                alo, blo = i+1, j+1
+            regions.append((alo, ahi, blo, bhi))
+        else:
+            matches.extend(myers_matches(a, alo, ahi, b, blo, bhi))
+    matches.sort()
+    opcodes = []
+    i = j = 0
+    for match_i, match_j in matches + [(len(a), len(b))]:
+        if i < match_i and j < match_j:
+            opcodes.append(("replace", i, match_i, j, match_j))
+        elif i < match_i:
+            opcodes.append(("delete", i, match_i, j, match_j))
+        elif j < match_j:
+            opcodes.append(("insert", i, match_i, j, match_j))
+        if match_i < len(a):
+            if opcodes and opcodes[-1][0] == "equal" and opcodes[-1][2] == match_i:
+                tag, i1, i2, j1, j2 = opcodes.pop()
+                opcodes.append(("equal", i1, match_i+1, j1, match_j+1))
+            else:
+                opcodes.append(("equal", match_i, match_i+1, match_j, match_j+1))
+        i, j = match_i+1, match_j+1
+    return opcodes
+
+def myers_matches(a, alo, ahi, b, blo, bhi, max_edits=200):
+    """
+    The (i, j) pairs matched by a shortest edit script between a[alo:ahi]
+    and b[blo:bhi], found with Myers' O(ND) algorithm. Gives up and
+    returns no matches when more than max_edits edits are needed.
+
+    >>> myers_matches(["a", "b", "c", "a"], 0, 4, ["b", "a", "c", "a"], 0, 4)
+    [(1, 0), (2, 2), (3, 3)]
+    >>> myers_matches(["a", "b"], 0, 2, ["c", "d"], 0, 2, max_edits=3)
+    []
+    """
+    n = ahi - alo
+    m = bhi - blo
+    v = {1: 0}
+    trace = []
+    for d in range(min(n+m, max_edits)+1):
+        trace.append(dict(v))
+        for k in range(-d, d+1, 2):
+            if k == -d or (k != d and v[k-1] < v[k+1]):
+                x = v[k+1]
+            else:
+                x = v[k-1] + 1
+            y = x - k
+            while x < n and y < m and a[alo+x] == b[blo+y]:
+                x += 1
+                y += 1
+            v[k] = x
+            if x >= n and y >= m:
+                matches = []
+                for d in range(d, -1, -1):
+                    previous = trace[d]
+                    k = x - y
+                    if k == -d or (k != d and previous[k-1] < previous[k+1]):
+                        k += 1
+                    else:
+                        k -= 1
+                    previous_x = previous[k]
+                    previous_y = previous_x - k
+                    while x > previous_x and y > previous_y:
+                        x -= 1
+                        y -= 1
+                        matches.append((alo+x, blo+y))
+                    x, y = previous_x, previous_y
+                return matches[::-1]
+    return []
+
+def patience_anchors(a, alo, ahi, b, blo, bhi):
+    """
+    The longest increasing sequence of (i, j) pairs where a[i] == b[j] and
+    the line is unique in both a[alo:ahi] and b[blo:bhi].
+
+    >>> patience_anchors(["x", "a", "b", "c"], 0, 4, ["a", "x", "c", "a"], 0, 4)
+    [(0, 1), (3, 2)]
+    """
+    a_unique = {}
+    for i in range(alo, ahi):
+        a_unique[a[i]] = None if a[i] in a_unique else i
+    b_unique = {}
+    for j in range(blo, bhi):
+        b_unique[b[j]] = None if b[j] in b_unique else j
+    pairs = sorted(
+        (i, b_unique[line])
+        for line, i in a_unique.items()
+        if i is not None and b_unique.get(line) is not None
+    )
+    tails = []
+    tail_indices = []
+    previous = []
+    for index, (i, j) in enumerate(pairs):
+        position = bisect.bisect_left(tails, j)
+        if position == len(tails):
+            tails.append(j)
+            tail_indices.append(index)
+        else:
+            tails[position] = j
+            tail_indices[position] = index
+        previous.append(tail_indices[position-1] if position > 0 else None)
+    anchors = []
+    index = tail_indices[-1] if tail_indices else None
+    while index is not None:
+        anchors.append(pairs[index])
+        index = previous[index]
+    return anchors[::-1]
+
 def strip_last_word(text):
     """
     >>> strip_last_word("hello there")
@@ -2731,5 +3972,14 @@ if __name__ == "__main__":
         else:
             print("OK")
             sys.exit(0)
+    elif "--convert" in sys.argv:
+        convert_notes_file(*sys.argv[sys.argv.index("--convert")+1:][:2])
+    elif "--benchmark-storage" in sys.argv:
+        benchmark_notes_files(sys.argv[sys.argv.index("--benchmark-storage")+1])
+    elif "--benchmark-parser" in sys.argv:
+        benchmark_note_text_parser()
     else:
+        if "--profile-startup" in sys.argv:
+            sys.argv.remove("--profile-startup")
+            STARTUP_PROFILER.enabled = True
         PygameCairoEngine().run(SmartNotesWidget)